@@ -0,0 +1,625 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import multiprocessing
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import click
+import numpy as np
+from PIL import Image
+from watermark_processor import WatermarkProcessor, WatermarkPosition, PillowBackend, OpenCVBackend
+from colorama import init, Fore, Style
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 初始化colorama以支持跨平台彩色输出
+init()
+
+# 默认测试的图片尺寸档位（百万像素）
+DEFAULT_SIZES = (0.3, 2.0, 12.0, 24.0, 50.0)
+
+# 默认的基准结果文件
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+IMAGE_WATERMARK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'demo_watermark.png')
+TEXT_WATERMARK = '© Benchmark 2024'
+
+def make_synthetic_image(megapixels: float, mode: str = 'RGB', seed: int = 0) -> Image.Image:
+    """生成指定像素数的合成测试图片（4:3，带噪声以接近真实照片）"""
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    rng = np.random.default_rng(seed)
+
+    # 低分辨率噪声放大后作为底图，避免纯色图片让编解码过于乐观
+    noise = rng.integers(0, 256, size=(max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8)
+    image = Image.fromarray(noise, 'RGB').resize((width, height), Image.Resampling.BILINEAR)
+    return image.convert(mode) if mode != 'RGB' else image
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存 (MB)，不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS单位为字节
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+def summarize(latencies, megapixels):
+    """根据单张耗时（秒）计算延迟分位数和吞吐量"""
+    values = np.array(latencies) * 1000
+    return {
+        'p50_ms': float(np.percentile(values, 50)),
+        'p90_ms': float(np.percentile(values, 90)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'mp_per_s': float(megapixels / (np.median(values) / 1000)),
+    }
+
+def run_size_class(megapixels, watermark_kind, positions, repeat, batch_count, workdir):
+    """在独立进程中运行一个尺寸档位的全部测试，返回测试结果列表"""
+    # 基准测试时关闭进度条和逐张日志
+    os.environ['TQDM_DISABLE'] = '1'
+    processor = WatermarkProcessor()
+    processor.logger.setLevel(logging.WARNING)
+    
+    watermark = IMAGE_WATERMARK if watermark_kind == 'image' else TEXT_WATERMARK
+    input_dir = os.path.join(workdir, f"{megapixels}mp")
+    source = os.path.join(input_dir, 'source_0.jpg')
+    output_dir = os.path.join(workdir, f"out_{megapixels}mp_{watermark_kind}")
+    
+    results = []
+    for position_value in positions:
+        position = WatermarkPosition(position_value)
+        
+        # process_single_image：预热一次后计时
+        output_path = os.path.join(output_dir, 'single.jpg')
+        processor.process_single_image(source, output_path, watermark, position)
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            processor.process_single_image(source, output_path, watermark, position)
+            latencies.append(time.perf_counter() - start)
+        results.append({
+            'megapixels': megapixels, 'watermark': watermark_kind,
+            'position': position_value, 'api': 'single',
+            **summarize(latencies, megapixels),
+        })
+        
+        # batch_process：整批只有一个样本，只按整批耗时折算吞吐量，不统计延迟分位数
+        if batch_count:
+            start = time.perf_counter()
+            success, _ = processor.batch_process(input_dir, output_dir, watermark, position=position)
+            elapsed = time.perf_counter() - start
+            results.append({
+                'megapixels': megapixels, 'watermark': watermark_kind,
+                'position': position_value, 'api': 'batch',
+                'p50_ms': None, 'p90_ms': None, 'p99_ms': None,
+                'mp_per_s': megapixels * max(success, 1) / elapsed,
+            })
+    
+    rss = peak_rss_mb()
+    for result in results:
+        result['peak_rss_mb'] = rss
+    return results
+
+def case_key(result):
+    """测试用例的唯一标识"""
+    return f"{result['megapixels']}MP/{result['watermark']}/{result['position']}/{result['api']}"
+
+def git_revision():
+    """当前提交的哈希，不在git仓库中时返回None"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@click.group()
+def cli():
+    """水印处理性能基准测试"""
+
+@cli.command()
+@click.option('--megapixels', '-m',
+              type=click.FloatRange(0.1, 100),
+              default=24.0,
+              help='测试图片像素数 (百万像素, 默认: 24)')
+@click.option('--watermark', '-w',
+              default='demo_watermark.png',
+              help='水印内容：文字内容或水印图片路径 (默认: demo_watermark.png)')
+def alloc(megapixels, watermark):
+    """对比直接合成与RGBA往返路径的内存分配"""
+    click.echo(f"\n{Fore.CYAN}📊 合成阶段内存分配 ({megapixels} MP){Style.RESET_ALL}\n")
+    click.echo(f"  {'模式':<6}{'位置':<14}{'路径':<8}{'Pillow分配':>10}{'NumPy峰值(MB)':>16}{'耗时(ms)':>10}")
+
+    for mode in ('RGB', 'L', 'RGBA'):
+        image = make_synthetic_image(megapixels, mode)
+        for position in (WatermarkPosition.DIAGONAL, WatermarkPosition.BOTTOM_RIGHT):
+            for path_name, direct_modes in (('直接', WatermarkProcessor.DIRECT_MODES), ('RGBA', ('RGBA',))):
+                processor = WatermarkProcessor()
+                processor.DIRECT_MODES = direct_modes
+
+                # 预热：构建水印素材和平铺图层，只统计每张图片的合成开销
+                processor._watermark_image(image.copy(), watermark, position)
+                target = image.copy()
+
+                Image.core.reset_stats()
+                tracemalloc.start()
+                start = time.perf_counter()
+                processor._watermark_image(target, watermark, position)
+                elapsed = (time.perf_counter() - start) * 1000
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                new_count = Image.core.get_stats()['new_count']
+
+                click.echo(f"  {mode:<6}{position.value:<14}{path_name:<8}"
+                           f"{new_count:>10}{peak / 1024 / 1024:>16.1f}{elapsed:>10.1f}")
+
+    click.echo(f"\n{Fore.YELLOW}💡 Pillow分配为合成过程中新建的图像缓冲区数量，NumPy峰值为混合时的临时数组峰值{Style.RESET_ALL}")
+
+@cli.command()
+@click.option('--megapixels', '-m',
+              type=click.FloatRange(0.1, 100),
+              default=24.0,
+              help='测试图片像素数 (百万像素, 默认: 24)')
+@click.option('--count', '-n',
+              type=click.IntRange(2, 100),
+              default=4,
+              help='每批图片张数 (默认: 4)')
+def tiles(megapixels, count):
+    """平铺区域缓存的效果：尺寸相同（命中）与尺寸各不相同（未命中）的批次，缓存开启与关闭对比"""
+    click.echo(f"\n{Fore.CYAN}📊 平铺区域缓存 ({megapixels} MP, 每批 {count} 张){Style.RESET_ALL}\n")
+    click.echo(f"  {'水印':<8}{'位置':<10}{'缓存':<6}{'未命中(ms)':>12}{'命中(ms)':>10}"
+               f"{'同尺寸批次(s)':>16}{'不同尺寸批次(s)':>18}")
+    base = make_synthetic_image(megapixels)
+    
+    def timed(processor, images, watermark, position):
+        latencies = []
+        for image in images:
+            start = time.perf_counter()
+            processor._watermark_image(image, watermark, position, 0.3)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+    
+    for kind, watermark in (('text', TEXT_WATERMARK), ('image', IMAGE_WATERMARK)):
+        for position in (WatermarkPosition.TILE, WatermarkPosition.DIAGONAL):
+            for label, processor in (('开启', WatermarkProcessor()), ('关闭', WatermarkProcessor(tile_cache_bytes=0))):
+                processor.logger.setLevel(logging.WARNING)
+                # 同尺寸批次：第一张之后命中缓存；不同尺寸批次：每张都未命中
+                same = timed(processor, [base.copy() for _ in range(count)], watermark, position)
+                mixed_images = [base.resize((base.size[0] - i - 1, base.size[1])) for i in range(count)]
+                mixed = timed(processor, mixed_images, watermark, position)
+                click.echo(f"  {kind:<8}{position.value:<10}{label:<6}"
+                           f"{np.median(mixed) * 1000:>12.0f}{np.median(same[1:]) * 1000:>10.0f}"
+                           f"{sum(same):>16.2f}{sum(mixed):>18.2f}")
+    
+    click.echo(f"\n{Fore.YELLOW}💡 缓存内容为混合区域（水印位置与素材非透明部分的交集），命中时省去排布计算{Style.RESET_ALL}")
+
+@cli.command()
+@click.option('--sizes',
+              default=','.join(str(size) for size in DEFAULT_SIZES),
+              help='测试的图片尺寸档位，百万像素，逗号分隔 (默认: 0.3,2,12,24,50)')
+@click.option('--positions',
+              default=','.join(position.value for position in WatermarkPosition),
+              help='测试的水印位置，逗号分隔 (默认: 全部位置)')
+@click.option('--watermarks',
+              type=click.Choice(['both', 'text', 'image']),
+              default='both',
+              help='测试的水印类型 (默认: both)')
+@click.option('--repeat', '-n',
+              type=click.IntRange(1, 1000),
+              default=5,
+              help='process_single_image 每个用例的重复次数 (默认: 5)')
+@click.option('--batch-count',
+              type=click.IntRange(0, 100),
+              default=4,
+              help='batch_process 每批的图片数，0 表示不测试批量处理 (默认: 4)')
+@click.option('--output', '-o',
+              type=click.Path(dir_okay=False),
+              help='把测试结果保存为JSON文件')
+@click.option('--baseline', '-b',
+              type=click.Path(dir_okay=False),
+              help=f'与之前保存的JSON结果对比 (例如 {DEFAULT_BASELINE})')
+@click.option('--threshold',
+              type=click.FloatRange(0, 100),
+              default=10.0,
+              help='吞吐量下降超过该百分比时标记为性能回退 (默认: 10)')
+def run(sizes, positions, watermarks, repeat, batch_count, output, baseline, threshold):
+    """运行完整的性能基准测试（离线合成测试图片）"""
+    size_list = [float(size) for size in sizes.split(',') if size]
+    position_list = [position for position in positions.split(',') if position]
+    for position in position_list:
+        WatermarkPosition(position)
+    kinds = ['text', 'image'] if watermarks == 'both' else [watermarks]
+    
+    click.echo(f"\n{Fore.CYAN}📊 水印处理性能基准{Style.RESET_ALL}")
+    click.echo(f"   尺寸档位: {', '.join(f'{size} MP' for size in size_list)}")
+    click.echo(f"   水印类型: {', '.join(kinds)}   重复次数: {repeat}   批量张数: {batch_count}\n")
+    
+    workdir = tempfile.mkdtemp(prefix='watermark_bench_')
+    results = []
+    try:
+        # 每个尺寸档位生成一次测试图片
+        for megapixels in size_list:
+            input_dir = os.path.join(workdir, f"{megapixels}mp")
+            os.makedirs(input_dir)
+            image = make_synthetic_image(megapixels)
+            for index in range(max(batch_count, 1)):
+                image.save(os.path.join(input_dir, f"source_{index}.jpg"), quality=90)
+        
+        # 每个 (尺寸, 水印类型) 在独立进程中运行，使峰值内存互不影响
+        context = multiprocessing.get_context('spawn')
+        for megapixels in size_list:
+            for kind in kinds:
+                click.echo(f"{Fore.BLUE}▶ {megapixels} MP / {kind}{Style.RESET_ALL}")
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    results.extend(executor.submit(
+                        run_size_class, megapixels, kind, position_list,
+                        repeat, batch_count, workdir
+                    ).result())
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    # 输出结果表格
+    click.echo(f"\n  {'用例':<36}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'MP/s':>10}{'峰值内存(MB)':>14}")
+    for result in results:
+        rss = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else '-'
+        latencies = ''.join(
+            f"{result[key]:>10.1f}" if result[key] is not None else f"{'-':>10}"
+            for key in ('p50_ms', 'p90_ms', 'p99_ms')
+        )
+        click.echo(f"  {case_key(result):<36}{latencies}{result['mp_per_s']:>10.1f}{rss:>14}")
+    
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    
+    regressed = bool(baseline) and compare_with_baseline(report, baseline, threshold)
+    
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        click.echo(f"\n{Fore.GREEN}💾 结果已保存: {output}{Style.RESET_ALL}")
+    
+    # 存在性能回退时以非零状态退出，便于在CI中使用
+    if regressed:
+        sys.exit(1)
+
+@cli.command()
+@click.option('--megapixels', '-m',
+              type=click.FloatRange(0.1, 100),
+              default=12.0,
+              help='测试图片像素数 (百万像素, 默认: 12)')
+@click.option('--formats',
+              default='jpg,png,webp,tif',
+              help='逗号分隔的输出格式 (默认: jpg,png,webp,tif)')
+@click.option('--repeat', '-n',
+              type=click.IntRange(1, 100),
+              default=3,
+              help='每个配置重复编码次数，取中位数 (默认: 3)')
+@click.option('--output', '-o',
+              help='将结果保存为JSON文件')
+def encoders(megapixels, formats, repeat, output):
+    """对比各编码配置的编码耗时与输出大小"""
+    extensions = [f".{ext.strip().lstrip('.').lower()}" for ext in formats.split(',') if ext.strip()]
+    processor = WatermarkProcessor()
+    image = processor._watermark_image(make_synthetic_image(megapixels), TEXT_WATERMARK,
+                                       WatermarkPosition.DIAGONAL)
+    workdir = tempfile.mkdtemp(prefix='wm_encoders_')
+
+    click.echo(f"\n{Fore.CYAN}📊 编码配置对比 ({megapixels} MP, 重复 {repeat} 次){Style.RESET_ALL}\n")
+    click.echo(f"  {'格式':<8}{'配置':<12}{'耗时(ms)':>10}{'大小(KB)':>12}{'相对balanced':>14}")
+
+    results = []
+    try:
+        for ext in extensions:
+            # JPEG额外测试沿用原图量化表（原图为quality=90编码的JPEG）
+            variants = [(profile, False) for profile in WatermarkProcessor.ENCODER_PROFILES]
+            source = None
+            if ext in ('.jpg', '.jpeg'):
+                source = os.path.join(workdir, 'source.jpg')
+                image.save(source, quality=90)
+                variants += [(profile, True) for profile in WatermarkProcessor.ENCODER_PROFILES]
+
+            rows = []
+            for profile, keep_tables in variants:
+                path = os.path.join(workdir, f"{profile}{'_tables' if keep_tables else ''}{ext}")
+                options = processor.encoder_options(path, profile, keep_tables, source)
+                latencies = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    processor._save_image(image, path, options)
+                    latencies.append(time.perf_counter() - start)
+                rows.append({
+                    'format': ext.lstrip('.'),
+                    'profile': profile,
+                    'keep_jpeg_tables': keep_tables,
+                    'encode_ms': round(float(np.median(latencies)) * 1000, 2),
+                    'bytes': os.path.getsize(path),
+                })
+
+            balanced_size = next(row['bytes'] for row in rows
+                                 if row['profile'] == WatermarkProcessor.DEFAULT_ENCODER_PROFILE)
+            for row in rows:
+                name = f"{row['profile']}{'+qt' if row['keep_jpeg_tables'] else ''}"
+                click.echo(f"  {row['format']:<8}{name:<12}{row['encode_ms']:>10.1f}"
+                           f"{row['bytes'] / 1024:>12.1f}{row['bytes'] / balanced_size * 100:>13.0f}%")
+            results.extend(rows)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    click.echo(f"\n{Fore.YELLOW}💡 +qt 表示沿用原图的JPEG量化表和色度抽样{Style.RESET_ALL}")
+
+    if output:
+        report = {
+            'revision': git_revision(),
+            'megapixels': megapixels,
+            'repeat': repeat,
+            'results': results,
+        }
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        click.echo(f"\n{Fore.GREEN}💾 结果已保存: {output}{Style.RESET_ALL}")
+
+def time_call(func, repeat):
+    """重复调用func，返回耗时中位数（毫秒）"""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies)) * 1000
+
+@cli.command()
+@click.option('--megapixels', '-m',
+              type=click.FloatRange(0.1, 100),
+              default=12.0,
+              help='测试图片像素数 (百万像素, 默认: 12)')
+@click.option('--formats',
+              default='jpg,png,webp,bmp',
+              help='逗号分隔的图片格式 (默认: jpg,png,webp,bmp)')
+@click.option('--repeat', '-n',
+              type=click.IntRange(1, 100),
+              default=3,
+              help='每项重复次数，取中位数 (默认: 3)')
+@click.option('--output', '-o',
+              help='将结果保存为JSON文件')
+def backends(megapixels, formats, repeat, output):
+    """对比Pillow与OpenCV后端各阶段的耗时，给出auto后端的选择"""
+    extensions = [f".{ext.strip().lstrip('.').lower()}" for ext in formats.split(',') if ext.strip()]
+    implementations = {'pillow': PillowBackend(), 'opencv': OpenCVBackend()}
+    image = make_synthetic_image(megapixels)
+    workdir = tempfile.mkdtemp(prefix='wm_backends_')
+
+    click.echo(f"\n{Fore.CYAN}📊 后端对比 ({megapixels} MP, 重复 {repeat} 次){Style.RESET_ALL}\n")
+    click.echo(f"  {'阶段':<10}{'格式':<8}{'pillow(ms)':>12}{'opencv(ms)':>12}{'更快':>10}")
+
+    results = []
+
+    def report(stage, image_format, timings):
+        faster = min(timings, key=timings.get)
+        click.echo(f"  {stage:<10}{image_format or '-':<8}{timings['pillow']:>12.1f}"
+                   f"{timings['opencv']:>12.1f}{faster:>10}")
+        results.append({'stage': stage, 'format': image_format, 'faster': faster,
+                        **{f'{name}_ms': round(ms, 2) for name, ms in timings.items()}})
+
+    try:
+        processor = WatermarkProcessor()
+        for ext in extensions:
+            source = os.path.join(workdir, f'source{ext}')
+            options = processor.encoder_options(source)
+            PillowBackend().encode(image, source, options)
+            image_format = options['format']
+
+            report('decode', image_format, {
+                name: time_call(lambda: backend.decode(source), repeat)
+                for name, backend in implementations.items()
+            })
+            target = os.path.join(workdir, f'target{ext}')
+            report('encode', image_format, {
+                name: time_call(lambda: backend.encode(image, target, options), repeat)
+                for name, backend in implementations.items()
+            })
+
+        # 混合：与图片同尺寸的半透明图层叠加到不透明的RGB像素上
+        layer = np.zeros((image.size[1], image.size[0], 4), dtype=np.uint8)
+        layer[::4, :, :] = (128, 128, 128, 128)
+        pixels = np.asarray(image).copy()
+        report('blend', None, {
+            name: time_call(lambda: backend.blend(pixels, layer), repeat)
+            for name, backend in implementations.items()
+        })
+
+        # 旋转：对角线平铺使用的文字水印素材
+        text = processor.create_text_watermark(TEXT_WATERMARK, font_size=int(min(image.size) * 0.05))
+        report('rotate', None, {
+            name: time_call(lambda: backend.rotate(text, 45), repeat)
+            for name, backend in implementations.items()
+        })
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    # 汇总为AutoBackend.OPENCV_STAGES的写法
+    stages = {}
+    for result in results:
+        if result['format'] is None:
+            stages[result['stage']] = result['faster'] == 'opencv'
+        else:
+            formats_for_stage = stages.setdefault(result['stage'], set())
+            if result['faster'] == 'opencv':
+                formats_for_stage.add(result['format'])
+    click.echo(f"\n{Fore.YELLOW}💡 auto后端使用OpenCV的阶段: {stages}{Style.RESET_ALL}")
+
+    if output:
+        data = {
+            'revision': git_revision(),
+            'megapixels': megapixels,
+            'repeat': repeat,
+            'results': results,
+        }
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        click.echo(f"\n{Fore.GREEN}💾 结果已保存: {output}{Style.RESET_ALL}")
+
+def multipart_body(fields, files):
+    """构造multipart/form-data请求体，返回 (请求体, Content-Type)"""
+    boundary = f"----wmbench{int(time.time() * 1000)}"
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+        parts.append(data)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+@cli.command()
+@click.option('--url',
+              default='http://127.0.0.1:5001',
+              help='水印服务地址 (默认: http://127.0.0.1:5001，由 python watermark_api.py 启动)')
+@click.option('--megapixels', '-m',
+              type=click.FloatRange(0.1, 100),
+              default=2.0,
+              help='测试图片像素数 (百万像素, 默认: 2)')
+@click.option('--requests', '-n', 'total',
+              type=click.IntRange(1, 100000),
+              default=100,
+              help='请求总数 (默认: 100)')
+@click.option('--concurrency', '-c',
+              type=click.IntRange(1, 1000),
+              default=8,
+              help='并发请求数 (默认: 8)')
+@click.option('--batch-size',
+              type=click.IntRange(0, 1000),
+              default=0,
+              help='每个请求的图片数，0表示调用单张接口 (默认: 0)')
+@click.option('--preset',
+              default='default',
+              help='水印预设 (默认: default)')
+@click.option('--output', '-o',
+              help='将结果保存为JSON文件')
+def http(url, megapixels, total, concurrency, batch_size, preset, output):
+    """对水印HTTP接口进行并发压测，统计延迟、吞吐量和429拒绝数"""
+    buffer = io.BytesIO()
+    make_synthetic_image(megapixels).save(buffer, 'JPEG', quality=90)
+    image = buffer.getvalue()
+
+    if batch_size:
+        endpoint = f"{url.rstrip('/')}/api/watermark/batch"
+        files = [('images', f'image_{i}.jpg', image) for i in range(batch_size)]
+    else:
+        endpoint = f"{url.rstrip('/')}/api/watermark"
+        files = [('image', 'image.jpg', image)]
+    body, content_type = multipart_body({'preset': preset}, files)
+
+    def send(_):
+        request = urllib.request.Request(endpoint, data=body, headers={'Content-Type': content_type})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                size = len(response.read())
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status, size = e.code, 0
+        except OSError:
+            status, size = None, 0
+        return status, time.perf_counter() - start, size
+
+    click.echo(f"\n{Fore.CYAN}📊 HTTP压测 {endpoint} ({megapixels} MP, "
+               f"{total} 个请求, 并发 {concurrency}){Style.RESET_ALL}\n")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(total)))
+    elapsed = time.perf_counter() - start
+
+    ok = [latency for status, latency, _ in results if status == 200]
+    rejected = sum(1 for status, _, _ in results if status == 429)
+    failed = len(results) - len(ok) - rejected
+    images = len(ok) * max(batch_size, 1)
+    report = {
+        'revision': git_revision(),
+        'endpoint': endpoint,
+        'megapixels': megapixels,
+        'requests': total,
+        'concurrency': concurrency,
+        'batch_size': batch_size,
+        'ok': len(ok),
+        'rejected_429': rejected,
+        'failed': failed,
+        'elapsed_s': round(elapsed, 3),
+        'images_per_s': round(images / elapsed, 2),
+        'response_mb': round(sum(size for _, _, size in results) / 1024 / 1024, 2),
+    }
+    if ok:
+        report.update(summarize(ok, megapixels * max(batch_size, 1)))
+
+    click.echo(f"  成功: {Fore.GREEN}{len(ok)}{Style.RESET_ALL}  "
+               f"429拒绝: {Fore.YELLOW}{rejected}{Style.RESET_ALL}  "
+               f"失败: {Fore.RED}{failed}{Style.RESET_ALL}")
+    click.echo(f"  吞吐量: {report['images_per_s']} 张/秒  总耗时: {report['elapsed_s']} 秒")
+    if ok:
+        click.echo(f"  延迟: p50 {report['p50_ms']:.1f} ms  p90 {report['p90_ms']:.1f} ms  "
+                   f"p99 {report['p99_ms']:.1f} ms")
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        click.echo(f"\n{Fore.GREEN}💾 结果已保存: {output}{Style.RESET_ALL}")
+
+def compare_with_baseline(report, baseline_path, threshold):
+    """与基准结果对比吞吐量，返回是否存在性能回退"""
+    try:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except (OSError, ValueError) as e:
+        click.echo(f"\n{Fore.RED}❌ 无法读取基准结果 {baseline_path}: {e}{Style.RESET_ALL}")
+        return False
+    
+    previous = {case_key(result): result for result in baseline.get('results', [])}
+    click.echo(f"\n{Fore.CYAN}📈 与基准对比 ({baseline.get('revision') or baseline_path}){Style.RESET_ALL}")
+    
+    regressed = False
+    for result in report['results']:
+        old = previous.get(case_key(result))
+        if not old:
+            continue
+        change = (result['mp_per_s'] / old['mp_per_s'] - 1) * 100
+        if change < -threshold:
+            regressed = True
+            color = Fore.RED
+        elif change > threshold:
+            color = Fore.GREEN
+        else:
+            color = ''
+        click.echo(f"  {case_key(result):<36}{old['mp_per_s']:>10.1f} -> {result['mp_per_s']:>8.1f} MP/s "
+                   f"{color}{change:+7.1f}%{Style.RESET_ALL}")
+    
+    if regressed:
+        click.echo(f"\n{Fore.RED}⚠️  存在吞吐量下降超过 {threshold}% 的用例{Style.RESET_ALL}")
+    return regressed
+
+if __name__ == '__main__':
+    cli()
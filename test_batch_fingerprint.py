@@ -0,0 +1,58 @@
+"""增量清单和续传日志的指纹只随影响输出的参数变化"""
+
+import os
+
+from PIL import Image
+
+from watermark_processor import BatchJournal, BatchManifest, WatermarkProcessor
+
+
+def make_inputs(directory, count=2):
+    os.makedirs(directory)
+    for index in range(count):
+        Image.new('RGB', (64, 48), (index * 60, 90, 120)).save(os.path.join(directory, f'{index}.jpg'))
+
+
+def fingerprint(**kwargs):
+    return WatermarkProcessor()._batch_fingerprint('TEST', '_watermarked', kwargs)
+
+
+def test_execution_only_params_do_not_change_fingerprint():
+    base = fingerprint(opacity=0.5)
+    assert fingerprint(opacity=0.5, frame_workers=4) == base
+    assert fingerprint(opacity=0.5, strip_mode=False) == base
+    assert fingerprint(opacity=0.5, strip_mode=None) == base
+
+
+def test_output_params_change_fingerprint():
+    base = fingerprint(opacity=0.5)
+    assert fingerprint(opacity=0.6) != base
+    assert fingerprint(opacity=0.5, strip_mode=True) != base
+
+
+def test_manifest_survives_frame_workers_change(tmp_path):
+    input_dir, output_dir = str(tmp_path / 'in'), str(tmp_path / 'out')
+    make_inputs(input_dir)
+    processor = WatermarkProcessor()
+    assert processor.batch_process(input_dir, output_dir, 'TEST', incremental=True) == (2, 0)
+    
+    processor = WatermarkProcessor()
+    processor.batch_process(input_dir, output_dir, 'TEST', incremental=True,
+                            frame_workers=4, strip_mode=False)
+    # 所有文件都被判断为未变化，没有重新处理
+    assert processor.last_results == []
+
+
+def test_journal_resumes_after_frame_workers_change(tmp_path):
+    output_dir = str(tmp_path / 'out')
+    processor = WatermarkProcessor()
+    first = BatchJournal(output_dir, processor._batch_fingerprint('TEST', '_watermarked', {}))
+    first.record(str(tmp_path / 'a.jpg'), str(tmp_path / 'a_out.jpg'))
+    first.close(finished=False)
+    
+    fingerprint = processor._batch_fingerprint('TEST', '_watermarked', {'frame_workers': 8})
+    journal = BatchJournal(output_dir, fingerprint, resume=True)
+    try:
+        assert journal.resumed
+    finally:
+        journal.close(finished=False)
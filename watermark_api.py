@@ -0,0 +1,600 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import json
+import shutil
+import signal
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+import click
+import cv2
+from flask import Blueprint, Flask, Response, jsonify, request, stream_with_context
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+from watermark_processor import LRUCache, WatermarkPlan, WatermarkPosition, WatermarkProcessor
+
+# 内置的水印预设，可以通过 --presets 或环境变量 WATERMARK_API_PRESETS 指定JSON文件替换
+DEFAULT_PRESETS = {
+    'default': {
+        'watermark': '© Watermark',
+        'position': 'tile',
+        'opacity': 0.3,
+    },
+    'logo': {
+        'watermark': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'demo_watermark.png'),
+        'position': 'bottom_right',
+        'opacity': 0.8,
+        'size_ratio': 0.15,
+    },
+}
+
+# 请求中可以覆盖的预设参数及其类型
+OVERRIDE_FIELDS = {
+    'text': str,
+    'position': str,
+    'opacity': float,
+    'size_ratio': float,
+    'rotation': int,
+    'spacing': int,
+    'margin': int,
+    'font_size': int,
+}
+
+# 单张上传图片的大小上限
+MAX_IMAGE_BYTES = 64 * 1024 * 1024
+
+# 一次批量请求最多处理的图片数量
+MAX_BATCH_IMAGES = 1000
+
+# 请求体的大小上限（注册接口时作为应用的MAX_CONTENT_LENGTH，应用已设置时不覆盖）
+MAX_REQUEST_BYTES = 512 * 1024 * 1024
+
+# zip请求体超过该大小时暂存到临时文件
+SPOOL_BYTES = 16 * 1024 * 1024
+
+watermark_api = Blueprint('watermark_api', __name__)
+
+@watermark_api.record_once
+def _limit_request_size(state):
+    state.app.config.setdefault('MAX_CONTENT_LENGTH', None)
+    if state.app.config['MAX_CONTENT_LENGTH'] is None:
+        state.app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
+# 多进程模式下每个工作进程独立持有的处理器实例和编译好的水印方案
+_worker_processor = None
+_worker_plans = None
+
+def _init_api_worker(backend: str):
+    """初始化工作进程"""
+    global _worker_processor, _worker_plans
+    # 中断信号由主进程统一处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    cv2.setNumThreads(1)
+    _worker_processor = WatermarkProcessor(backend=backend)
+    _worker_plans = LRUCache(WatermarkService.PLAN_CACHE_SIZE)
+
+def _watermark_in_worker(
+    data: bytes,
+    plan: WatermarkPlan,
+    image_format: Optional[str],
+    options: dict
+) -> Tuple[bytes, str]:
+    """在工作进程中处理一张图片，返回 (编码结果, 输出格式)
+
+    同一方案在工作进程中只保留一份，各尺寸的图层只在第一次遇到时构建。
+    """
+    cached = _worker_plans.get(plan.fingerprint)
+    if cached is None:
+        _worker_plans.put(plan.fingerprint, plan)
+        cached = plan
+    output = io.BytesIO()
+    image_format = _worker_processor.process_stream(data, output, cached, image_format, **options)
+    return output.getvalue(), image_format
+
+class WatermarkService:
+    """在有界进程池中执行水印任务的服务
+
+    排队和执行中的任务总数不超过max_pending，饱和时拒绝新请求（接口返回HTTP 429）。
+    每个预设及其参数覆盖组合只编译一次水印方案。
+    """
+
+    PLAN_CACHE_SIZE = 64
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        presets: Optional[dict] = None,
+        backend: str = 'pillow',
+        timeout: float = 60.0
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        self.presets = dict(presets if presets is not None else DEFAULT_PRESETS)
+        self.backend = backend
+        self.timeout = timeout
+        self.plans = LRUCache(self.PLAN_CACHE_SIZE)
+        self.rejected = 0
+        self._processor = WatermarkProcessor(backend=backend)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_api_worker,
+                    initargs=(self.backend,)
+                )
+            return self._executor
+
+    def plan(self, preset: str, overrides: dict) -> WatermarkPlan:
+        """获取预设（及参数覆盖）编译好的水印方案"""
+        if preset not in self.presets:
+            raise ValueError(f"未知的预设: {preset}")
+        key = (preset, tuple(sorted(overrides.items())))
+        plan = self.plans.get(key)
+        if plan is not None:
+            return plan
+
+        params = dict(self.presets[preset])
+        params.update(overrides)
+        if 'text' in params:
+            params['watermark'] = params.pop('text')
+        params['position'] = WatermarkPosition(params.get('position', 'tile'))
+        plan = self._processor.compile(**params)
+        self.plans.put(key, plan)
+        return plan
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """占用一个在途任务名额，timeout为None时不等待"""
+        if timeout is None:
+            acquired = self._slots.acquire(blocking=False)
+        else:
+            acquired = self._slots.acquire(timeout=timeout)
+        with self._lock:
+            if acquired:
+                self._pending += 1
+            else:
+                self.rejected += 1
+        return acquired
+
+    def release(self, *_) -> None:
+        """归还一个在途任务名额"""
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def submit(self, data: bytes, plan: WatermarkPlan, image_format: Optional[str], options: dict):
+        """把已占用名额的任务提交到进程池，任务结束时自动归还名额"""
+        try:
+            future = self._get_executor().submit(_watermark_in_worker, data, plan, image_format, options)
+        except BrokenProcessPool:
+            # 工作进程异常退出后进程池不可再用，换一个新的进程池重试一次
+            with self._lock:
+                self._executor = None
+            try:
+                future = self._get_executor().submit(_watermark_in_worker, data, plan, image_format, options)
+            except BaseException:
+                self.release()
+                raise
+        except BaseException:
+            self.release()
+            raise
+        future.add_done_callback(self.release)
+        return future
+
+    def status(self) -> dict:
+        with self._lock:
+            pending = self._pending
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': pending,
+            'rejected': self.rejected,
+            'presets': sorted(self.presets),
+            'plan_cache': {'size': len(self.plans), 'hits': self.plans.hits, 'misses': self.plans.misses},
+        }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+_service = None
+_service_lock = threading.Lock()
+
+def configure(**kwargs) -> WatermarkService:
+    """创建（或替换）接口使用的服务，参数同WatermarkService"""
+    global _service
+    with _service_lock:
+        if _service is not None:
+            _service.shutdown()
+        _service = WatermarkService(**kwargs)
+        return _service
+
+def get_service() -> WatermarkService:
+    """获取接口使用的服务，未配置时按环境变量创建"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            presets = None
+            if os.environ.get('WATERMARK_API_PRESETS'):
+                presets = load_presets(os.environ['WATERMARK_API_PRESETS'])
+            _service = WatermarkService(
+                workers=int(os.environ.get('WATERMARK_API_WORKERS', 0)) or None,
+                max_pending=int(os.environ.get('WATERMARK_API_QUEUE', 0)) or None,
+                presets=presets,
+                backend=os.environ.get('WATERMARK_API_BACKEND', 'pillow')
+            )
+        return _service
+
+def load_presets(path: str) -> dict:
+    """读取JSON格式的预设文件：{预设名: {watermark, position, opacity, ...}}"""
+    with open(path, encoding='utf-8') as f:
+        presets = json.load(f)
+    if not isinstance(presets, dict) or not all(isinstance(p, dict) for p in presets.values()):
+        raise ValueError(f"预设文件格式不正确: {path}")
+    return presets
+
+def _error(message: str, status: int, **headers) -> Response:
+    response = jsonify({'success': False, 'message': message})
+    response.status_code = status
+    response.headers.update(headers)
+    return response
+
+def _busy() -> Response:
+    return _error('服务繁忙，请稍后重试', 429, **{'Retry-After': '1'})
+
+def _request_options() -> Tuple[str, dict, Optional[str], dict]:
+    """解析请求参数，返回 (预设名, 参数覆盖, 输出格式, 编码参数)"""
+    values = request.values
+    overrides = {}
+    for name, kind in OVERRIDE_FIELDS.items():
+        if values.get(name) not in (None, ''):
+            try:
+                overrides[name] = kind(values[name])
+            except ValueError:
+                raise ValueError(f"参数 {name} 的值无效: {values[name]}") from None
+    if 'text' in overrides and os.path.exists(overrides['text']):
+        # 请求中的文字不能指向服务器上的文件
+        raise ValueError("text 只能是水印文字")
+    if 'position' in overrides:
+        WatermarkPosition(overrides['position'])
+
+    options = {}
+    if values.get('profile'):
+        if values['profile'] not in WatermarkProcessor.ENCODER_PROFILES:
+            raise ValueError(f"未知的编码配置: {values['profile']}")
+        options['encoder_profile'] = values['profile']
+    if values.get('keep_jpeg_tables', '').lower() in ('1', 'true', 'yes', 'on'):
+        options['keep_jpeg_tables'] = True
+    if values.get('max_size'):
+        try:
+            sizes = tuple(int(n) for n in values['max_size'].lower().split('x'))
+        except ValueError:
+            sizes = ()
+        if len(sizes) not in (1, 2) or min(sizes) < 1:
+            raise ValueError(f"max_size 应为最长边或 宽x高: {values['max_size']}")
+        options['max_size'] = sizes[0] if len(sizes) == 1 else sizes
+    if values.get('scale'):
+        try:
+            options['scale'] = float(values['scale'])
+        except ValueError:
+            raise ValueError(f"参数 scale 的值无效: {values['scale']}") from None
+        if not 0 < options['scale'] <= 1:
+            raise ValueError("scale 应在 0 ~ 1 之间")
+    return values.get('preset', 'default'), overrides, values.get('format') or None, options
+
+def _read_upload(storage) -> bytes:
+    data = storage.read(MAX_IMAGE_BYTES + 1)
+    if len(data) > MAX_IMAGE_BYTES:
+        raise OverflowError(f"图片超过 {MAX_IMAGE_BYTES // 1024 // 1024} MB: {storage.filename}")
+    return data
+
+class _UploadSpool:
+    """批量请求中的图片，复制到本请求独占的临时文件后供流式响应逐张读取
+
+    Flask在视图返回时就会关闭请求中的上传文件，而图片要到流式响应中才逐张读取。
+    多个image文件依次写入同一个临时文件，只记录每张图片的位置和长度；
+    zip压缩包较大时同样暂存到磁盘，不整个读入内存。
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._entries = []   # (文件名, 偏移, 长度)
+        self._archives = []
+
+    @classmethod
+    def from_request(cls) -> '_UploadSpool':
+        spool = cls()
+        try:
+            if request.mimetype == 'application/zip':
+                spool._add_archive(request.stream)
+                return spool
+            storages = request.files.getlist('images') or request.files.getlist('image')
+            if len(storages) > MAX_BATCH_IMAGES:
+                raise OverflowError(f"一次最多处理 {MAX_BATCH_IMAGES} 张图片")
+            for index, storage in enumerate(storages, 1):
+                spool._add_image(os.path.basename(storage.filename or f'image_{index}'), storage)
+            for storage in request.files.getlist('archive'):
+                spool._add_archive(storage)
+        except BaseException:
+            spool.close()
+            raise
+        return spool
+
+    def _add_image(self, name: str, storage) -> None:
+        offset = self._file.tell()
+        remaining = MAX_IMAGE_BYTES + 1
+        while remaining > 0:
+            chunk = storage.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            self._file.write(chunk)
+            remaining -= len(chunk)
+        size = self._file.tell() - offset
+        if size > MAX_IMAGE_BYTES:
+            raise OverflowError(f"图片超过 {MAX_IMAGE_BYTES // 1024 // 1024} MB: {name}")
+        self._entries.append((name, offset, size))
+
+    def _add_archive(self, source) -> None:
+        archive = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+        self._archives.append(archive)
+        shutil.copyfileobj(source, archive)
+        archive.seek(0)
+
+    def __iter__(self) -> Iterator[Tuple[str, bytes]]:
+        """逐张读出图片：先是image文件，再是zip压缩包中支持的图片"""
+        processor = get_service()._processor
+        count = 0
+        for name, offset, size in self._entries:
+            count += 1
+            self._file.seek(offset)
+            yield name, self._file.read(size)
+
+        for archive in self._archives:
+            with zipfile.ZipFile(archive) as zf:
+                for info in zf.infolist():
+                    if info.is_dir() or not processor.is_supported_format(info.filename):
+                        continue
+                    if info.file_size > MAX_IMAGE_BYTES:
+                        raise OverflowError(f"图片超过 {MAX_IMAGE_BYTES // 1024 // 1024} MB: {info.filename}")
+                    count += 1
+                    if count > MAX_BATCH_IMAGES:
+                        raise OverflowError(f"一次最多处理 {MAX_BATCH_IMAGES} 张图片")
+                    yield info.filename, zf.read(info)
+
+    def close(self) -> None:
+        self._file.close()
+        for archive in self._archives:
+            archive.close()
+
+def _output_name(name: str, image_format: str) -> str:
+    """生成输出文件名，与批量处理的命名方式一致"""
+    path = Path(name)
+    ext = path.suffix
+    if Image.registered_extensions().get(ext.lower()) != image_format:
+        ext = next(e for e, f in Image.registered_extensions().items() if f == image_format)
+    return str(path.with_name(f"{path.stem}_watermarked{ext}"))
+
+class _ZipStream:
+    """收集ZipFile写出的数据块，供流式响应逐块发送
+
+    不提供tell/seek，ZipFile因此按不可回写的流写入（使用数据描述符）。
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(data if isinstance(data, bytes) else bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> List[bytes]:
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+@watermark_api.errorhandler(RequestEntityTooLarge)
+def _request_too_large(e):
+    return _error(f'请求超过 {MAX_REQUEST_BYTES // 1024 // 1024} MB', 413)
+
+@watermark_api.route('/api/watermark', methods=['POST'])
+def watermark_image():
+    """单张图片水印API：上传image文件（或以图片作为请求体），直接返回处理后的图片"""
+    service = get_service()
+    try:
+        preset, overrides, image_format, options = _request_options()
+        plan = service.plan(preset, overrides)
+        if 'image' in request.files:
+            data = _read_upload(request.files['image'])
+        elif request.mimetype.startswith('image/'):
+            data = request.get_data()
+        else:
+            return _error('请上传图片（image字段或图片请求体）', 400)
+    except OverflowError as e:
+        return _error(str(e), 413)
+    except (ValueError, OSError) as e:
+        return _error(str(e), 400)
+
+    if not service.acquire():
+        return _busy()
+    future = service.submit(data, plan, image_format, options)
+    try:
+        result, image_format = future.result(timeout=service.timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        return _error('处理超时', 504)
+    except (ValueError, OSError, SyntaxError) as e:
+        return _error(f'图片处理失败: {e}', 422)
+    except Exception as e:
+        return _error(f'图片处理失败: {e}', 500)
+
+    # MIME类型表在Pillow加载全部格式插件后才完整
+    Image.init()
+    return Response(result, mimetype=Image.MIME.get(image_format, 'application/octet-stream'))
+
+@watermark_api.route('/api/watermark/batch', methods=['POST'])
+def watermark_batch():
+    """批量水印API：上传多个images文件或zip压缩包，以zip流式返回处理结果
+
+    处理完一张即写入响应，压缩包末尾的manifest.json记录每张图片的处理结果。
+    """
+    service = get_service()
+    try:
+        preset, overrides, image_format, options = _request_options()
+        plan = service.plan(preset, overrides)
+        # 图片边读取边提交，同一时刻只有在途的几张在内存中
+        spool = _UploadSpool.from_request()
+    except OverflowError as e:
+        return _error(str(e), 413)
+    except (ValueError, OSError, zipfile.BadZipFile) as e:
+        return _error(str(e), 400)
+    uploads = iter(spool)
+    try:
+        first_upload = next(uploads, None)
+    except OverflowError as e:
+        spool.close()
+        return _error(str(e), 413)
+    except (ValueError, OSError, zipfile.BadZipFile) as e:
+        spool.close()
+        return _error(str(e), 400)
+    if first_upload is None:
+        spool.close()
+        return _error('没有找到支持的图片文件', 400)
+
+    # 第一张图片拿不到名额时直接拒绝，之后的图片在本请求的结果返回后依次提交
+    if not service.acquire():
+        spool.close()
+        return _busy()
+
+    # 预先占用的名额在提交第一张图片时转交给任务；响应没有被读取就关闭时在这里归还
+    held = {'slot': True}
+    held_lock = threading.Lock()
+
+    def release_held():
+        with held_lock:
+            slot, held['slot'] = held['slot'], False
+        if slot:
+            service.release()
+
+    def next_upload():
+        try:
+            return next(uploads, None), None
+        except (OverflowError, ValueError, OSError, zipfile.BadZipFile) as e:
+            return None, str(e)
+
+    def generate():
+        stream = _ZipStream()
+        manifest = []
+        pending = {}
+        upload = first_upload
+        try:
+            with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as zf:
+                while True:
+                    # 每个请求最多占用workers个名额，避免单个大批量请求占满进程池
+                    while upload is not None and len(pending) < service.workers:
+                        name, data = upload
+                        with held_lock:
+                            first, held['slot'] = held['slot'], False
+                        if not first and not service.acquire(timeout=service.timeout):
+                            manifest.append({'file': name, 'success': False, 'message': '等待处理超时'})
+                        else:
+                            pending[service.submit(data, plan, image_format, options)] = name
+                        del data
+                        upload, error = next_upload()
+                        if error:
+                            manifest.append({'file': None, 'success': False, 'message': error})
+                    if not pending:
+                        break
+
+                    done, _ = wait(pending, timeout=service.timeout, return_when=FIRST_COMPLETED)
+                    if not done:
+                        for future, name in pending.items():
+                            future.cancel()
+                            manifest.append({'file': name, 'success': False, 'message': '处理超时'})
+                        pending.clear()
+                        continue
+                    for future in done:
+                        name = pending.pop(future)
+                        try:
+                            result, output_format = future.result()
+                        except Exception as e:
+                            manifest.append({'file': name, 'success': False, 'message': str(e)})
+                            continue
+                        output_name = _output_name(name, output_format)
+                        zf.writestr(output_name, result)
+                        manifest.append({'file': name, 'success': True, 'output': output_name})
+                        yield from stream.drain()
+
+                zf.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+            yield from stream.drain()
+        finally:
+            # 客户端中途断开时取消尚未开始的任务，名额随任务结束归还
+            for future in pending:
+                future.cancel()
+            release_held()
+            uploads.close()
+            spool.close()
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=watermarked.zip'}
+    )
+    response.call_on_close(release_held)
+    response.call_on_close(spool.close)
+    return response
+
+@watermark_api.route('/api/watermark/status', methods=['GET'])
+def watermark_status():
+    """水印服务状态API：进程池容量、在途任务数和预设列表"""
+    return jsonify({'success': True, **get_service().status()})
+
+def create_app() -> Flask:
+    """创建只包含水印接口的Flask应用，用于单独部署和本地压测"""
+    app = Flask(__name__)
+    app.register_blueprint(watermark_api)
+    return app
+
+@click.command()
+@click.option('--host', default='127.0.0.1', help='监听地址 (默认: 127.0.0.1)')
+@click.option('--port', default=5001, type=int, help='监听端口 (默认: 5001)')
+@click.option('--workers', '-j', type=click.IntRange(1, 256), help='工作进程数 (默认: CPU核心数)')
+@click.option('--queue', 'max_pending', type=click.IntRange(1, 10000),
+              help='排队和执行中的任务上限，超出时返回429 (默认: 工作进程数×2)')
+@click.option('--presets', type=click.Path(exists=True, dir_okay=False), help='JSON格式的水印预设文件')
+@click.option('--backend', type=click.Choice(['pillow', 'opencv', 'auto']), default='pillow',
+              help='编解码、混合和旋转的实现 (默认: pillow)')
+def main(host, port, workers, max_pending, presets, backend):
+    """单独启动水印HTTP服务"""
+    service = configure(
+        workers=workers,
+        max_pending=max_pending,
+        presets=load_presets(presets) if presets else None,
+        backend=backend
+    )
+    print(f"🚀 水印服务: http://{host}:{port}/api/watermark "
+          f"(工作进程 {service.workers}，队列上限 {service.max_pending})")
+    try:
+        create_app().run(host=host, port=port, threaded=True)
+    finally:
+        service.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,16 @@
 
 import os
 import sys
+import time
+import asyncio
 import click
 from pathlib import Path
-from watermark_processor import WatermarkProcessor, WatermarkPosition
+from PIL import Image
+from watermark_processor import (
+    WatermarkProcessor, WatermarkPosition, Rendition, font_registry, BACKENDS,
+    TimingStats, JsonlTimingSink, PrometheusTimingSink
+)
+from tqdm import tqdm
 from colorama import init, Fore, Style
 
 # 初始化colorama以支持跨平台彩色输出
@@ -38,6 +45,65 @@ def validate_output_dir(ctx, param, value):
             raise click.BadParameter(f'无法创建输出目录 {value}: {e}')
     return value
 
+# 条带模式选项到strip_mode参数的映射
+STRIP_MODES = {'auto': None, 'on': True, 'off': False}
+
+def validate_pipeline_threads(ctx, param, value):
+    """验证流水线线程数参数"""
+    try:
+        threads = tuple(int(n) for n in value.split(','))
+    except ValueError:
+        threads = ()
+    if len(threads) != 3 or min(threads) < 1:
+        raise click.BadParameter(f'格式应为 读取,合成,写入 三个正整数，例如 2,2,2: {value}')
+    return threads
+
+def parse_size(value):
+    """解析输出尺寸：最长边（如 2048）或 宽x高（如 1920x1080），无效时返回None"""
+    try:
+        sizes = tuple(int(n) for n in value.lower().split('x'))
+    except ValueError:
+        return None
+    if len(sizes) not in (1, 2) or min(sizes) < 1:
+        return None
+    return sizes[0] if len(sizes) == 1 else sizes
+
+def validate_max_size(ctx, param, value):
+    """验证输出尺寸参数"""
+    if value is None:
+        return None
+    max_size = parse_size(value)
+    if max_size is None:
+        raise click.BadParameter(f'尺寸应为最长边或 宽x高，例如 2048 或 1920x1080: {value}')
+    return max_size
+
+def validate_renditions(ctx, param, value):
+    """解析输出版本参数：后缀[:最长边、宽x高或百分比[:格式[:水印]]]"""
+    renditions = []
+    for spec in value:
+        parts = spec.split(':', 3)
+        suffix = parts[0]
+        if not suffix:
+            raise click.BadParameter(f'输出版本需要文件名后缀，例如 _web:2048:webp: {spec}')
+        max_size = scale = None
+        if len(parts) > 1 and parts[1].endswith('%'):
+            try:
+                scale = float(parts[1][:-1]) / 100
+            except ValueError:
+                scale = 0
+            if not 0 < scale <= 1:
+                raise click.BadParameter(f'缩放比例应在 0% ~ 100% 之间: {spec}')
+        elif len(parts) > 1 and parts[1]:
+            max_size = parse_size(parts[1])
+            if max_size is None:
+                raise click.BadParameter(f'尺寸应为最长边、宽x高或百分比，例如 2048、1920x1080 或 50%: {spec}')
+        image_format = parts[2] if len(parts) > 2 and parts[2] else None
+        if image_format and '.' + image_format.lower().lstrip('.') not in Image.registered_extensions():
+            raise click.BadParameter(f'不支持的输出格式: {spec}')
+        watermark = parts[3] if len(parts) > 3 and parts[3] else None
+        renditions.append(Rendition(suffix, max_size, image_format, watermark, scale=scale))
+    return renditions
+
 @click.group()
 @click.version_option("1.0.0")
 def cli():
@@ -93,14 +159,106 @@ def cli():
 @click.option('--font-color',
               default='white',
               help='文字水印颜色 (默认: white)')
+@click.option('--font',
+              help='文字水印字体：字体文件路径或系统字体名 (默认自动选择支持中文的系统字体)')
 @click.option('--preview',
               is_flag=True,
-              help='预览模式：只处理第一张图片用于预览效果')
+              help='预览模式：以屏幕分辨率快速渲染抽样图片的预览效果')
+@click.option('--preview-count',
+              type=click.IntRange(1, None),
+              default=1,
+              help='预览模式下从批量图片中均匀抽取的张数 (默认: 1)')
+@click.option('--preview-size',
+              type=click.IntRange(100, 10000),
+              default=1280,
+              help='预览图的最大边长 (像素, 默认: 1280)')
+@click.option('--workers', '-j',
+              type=click.IntRange(0, None),
+              default=1,
+              help='并行处理的进程数 (0 表示使用全部CPU核心, 默认: 1)')
+@click.option('--pipeline',
+              is_flag=True,
+              help='流水线模式：读取、合成、写入分阶段并发执行，适合网络存储')
+@click.option('--pipeline-threads',
+              default='2,2,2',
+              callback=validate_pipeline_threads,
+              help='流水线各阶段线程数 读取,合成,写入 (默认: 2,2,2)')
+@click.option('--rendition', 'renditions',
+              multiple=True,
+              callback=validate_renditions,
+              help='输出版本 后缀[:最长边、宽x高或百分比[:格式[:水印]]]，可多次指定，每张图片只解码一次 '
+                   '(例如 _full、_web:2048:webp、_thumb:400、_half:50%)')
+@click.option('--async-io', 'async_io',
+              is_flag=True,
+              help='异步模式：并发读写大量文件、合成交给进程池，适合NFS/SMB等高延迟存储')
+@click.option('--concurrency',
+              type=click.IntRange(1, 1024),
+              default=16,
+              help='异步模式下同时读写/处理的图片数 (默认: 16)')
+@click.option('--incremental',
+              is_flag=True,
+              help='增量模式：跳过自上次处理后输入文件和水印参数都未变化的图片')
+@click.option('--hash', 'hash_content',
+              is_flag=True,
+              help='增量模式下用内容哈希确认修改时间变化的文件是否真的改动过')
+@click.option('--resume',
+              is_flag=True,
+              help='续传模式：跳过上次被中断的批处理中已完成的图片')
+@click.option('--timing',
+              is_flag=True,
+              help='统计并显示解码、合成、编码等各阶段的耗时')
+@click.option('--trace',
+              type=click.Path(dir_okay=False),
+              help='把每张图片的阶段耗时追加写入JSONL跟踪文件')
+@click.option('--metrics',
+              type=click.Path(dir_okay=False),
+              help='把阶段耗时汇总以Prometheus文本格式写入文件')
+@click.option('--strips',
+              type=click.Choice(['auto', 'on', 'off']),
+              default='auto',
+              help='超大TIFF按条带读取和写入以限制内存占用 (默认: auto，超过1亿像素时启用)')
+@click.option('--frame-workers',
+              type=click.IntRange(1, 64),
+              default=1,
+              help='动画GIF/WebP并行混合各帧的线程数 (默认: 1)')
+@click.option('--include',
+              multiple=True,
+              help='只处理匹配的文件，glob模式，可多次指定 (例如 "*.jpg" 或 "2024/*")')
+@click.option('--exclude',
+              multiple=True,
+              help='跳过匹配的文件或目录，glob模式，可多次指定 (例如 ".*" 或 "thumbs")')
+@click.option('--sorted', 'sort_files',
+              is_flag=True,
+              help='按文件名顺序处理（默认按扫描到的顺序边扫描边处理）')
+@click.option('--yes', '-y',
+              is_flag=True,
+              help='不统计文件数、不确认，扫描到文件后立即开始处理')
+@click.option('--profile',
+              type=click.Choice(list(WatermarkProcessor.ENCODER_PROFILES)),
+              default=WatermarkProcessor.DEFAULT_ENCODER_PROFILE,
+              help='编码配置: fast 编码最快 / balanced 均衡 / small 文件最小 (默认: balanced)')
+@click.option('--keep-jpeg-tables',
+              is_flag=True,
+              help='JPEG输出沿用原图的量化表和色度抽样')
+@click.option('--max-size',
+              callback=validate_max_size,
+              help='输出尺寸上限：最长边或 宽x高 (例如 2048 或 1920x1080)，先缩小再添加水印')
+@click.option('--scale',
+              type=click.FloatRange(0.01, 1.0),
+              help='输出缩放比例 (例如 0.5)，先缩小再添加水印')
+@click.option('--backend',
+              type=click.Choice(list(BACKENDS)),
+              default='pillow',
+              help='编解码、混合和旋转的实现: pillow / opencv / auto 按格式选择更快的实现 (默认: pillow)')
 def batch(input, output, watermark, position, opacity, size, rotation, 
-          spacing, margin, recursive, suffix, font_size, font_color, preview):
+          spacing, margin, recursive, suffix, font_size, font_color, font, preview,
+          preview_count, preview_size, workers, pipeline, pipeline_threads,
+          incremental, hash_content, resume, timing, trace, metrics, strips,
+          include, exclude, sort_files, yes, frame_workers, profile, keep_jpeg_tables,
+          max_size, scale, backend, async_io, concurrency, renditions):
     """批量给图片添加水印"""
     
-    processor = WatermarkProcessor()
+    processor = WatermarkProcessor(backend=backend)
     
     # 转换位置参数
     position_map = {
@@ -129,24 +287,42 @@ def batch(input, output, watermark, position, opacity, size, rotation,
     else:
         click.echo(f"   边距: {margin}px")
     click.echo(f"   递归处理: {'是' if recursive else '否'}")
+    click.echo(f"   并行进程: {workers if workers else os.cpu_count()}")
+    if max_size or scale:
+        click.echo(f"   输出尺寸: {'最长边 ' if isinstance(max_size, int) else ''}"
+                   f"{'x'.join(map(str, max_size)) if isinstance(max_size, tuple) else max_size or ''}"
+                   f"{' ' if max_size and scale else ''}{f'缩放 {scale}' if scale else ''}")
+    if renditions:
+        click.echo(f"   输出版本: {', '.join(r.suffix for r in renditions)}")
+    if async_io:
+        click.echo(f"   异步模式: 并发 {concurrency}")
+    if pipeline:
+        click.echo(f"   流水线线程: 读取 {pipeline_threads[0]} / 合成 {pipeline_threads[1]} / 写入 {pipeline_threads[2]}")
+    click.echo(f"   增量模式: {'是' if incremental else '否'}{'（内容哈希）' if incremental and hash_content else ''}")
+    click.echo(f"   续传模式: {'是' if resume else '否'}")
+    click.echo(f"   处理后端: {backend}")
+    click.echo(f"   编码配置: {profile}{'（沿用JPEG量化表）' if keep_jpeg_tables else ''}")
+    if include or exclude:
+        click.echo(f"   文件筛选: 包含 {', '.join(include) or '全部'}；排除 {', '.join(exclude) or '无'}")
     click.echo(f"   预览模式: {'是' if preview else '否'}{Style.RESET_ALL}\n")
     
-    # 获取图片文件列表
-    image_files = processor.get_image_files(input, recursive)
-    
-    if not image_files:
-        click.echo(f"{Fore.RED}❌ 在指定路径中没有找到支持的图片文件{Style.RESET_ALL}")
-        return
-    
     if preview:
-        image_files = image_files[:1]
-        click.echo(f"{Fore.BLUE}🔍 预览模式：只处理第一张图片{Style.RESET_ALL}")
-    
-    click.echo(f"{Fore.GREEN}📁 找到 {len(image_files)} 张图片{Style.RESET_ALL}")
-    
-    # 确认处理
-    if not preview and len(image_files) > 1:
-        if not click.confirm(f'\n确定要处理这 {len(image_files)} 张图片吗？'):
+        # 获取图片文件列表
+        image_files = processor.get_image_files(input, recursive, include, exclude)
+        if not image_files:
+            click.echo(f"{Fore.RED}❌ 在指定路径中没有找到支持的图片文件{Style.RESET_ALL}")
+            return
+        image_files = processor.sample_files(image_files, preview_count)
+        click.echo(f"{Fore.BLUE}🔍 预览模式：抽取 {len(image_files)} 张图片渲染预览{Style.RESET_ALL}")
+    elif not yes:
+        # 统计文件数后确认处理
+        file_count = sum(1 for _ in processor.iter_image_files(input, recursive, include, exclude))
+        if not file_count:
+            click.echo(f"{Fore.RED}❌ 在指定路径中没有找到支持的图片文件{Style.RESET_ALL}")
+            return
+        
+        click.echo(f"{Fore.GREEN}📁 找到 {file_count} 张图片{Style.RESET_ALL}")
+        if file_count > 1 and not click.confirm(f'\n确定要处理这 {file_count} 张图片吗？'):
             click.echo(f"{Fore.YELLOW}⏹️  操作已取消{Style.RESET_ALL}")
             return
     
@@ -159,11 +335,21 @@ def batch(input, output, watermark, position, opacity, size, rotation,
         'spacing': spacing,
         'margin': margin,
     }
+    if strips != 'auto':
+        kwargs['strip_mode'] = STRIP_MODES[strips]
+    if frame_workers > 1:
+        kwargs['frame_workers'] = frame_workers
+    if profile != WatermarkProcessor.DEFAULT_ENCODER_PROFILE:
+        kwargs['encoder_profile'] = profile
+    if keep_jpeg_tables:
+        kwargs['keep_jpeg_tables'] = True
     
     # 添加文字水印特定参数
     if not os.path.exists(watermark):  # 文字水印
         if font_size:
             kwargs['font_size'] = font_size
+        if font:
+            kwargs['font_path'] = font
         
         # 解析颜色
         color_map = {
@@ -175,18 +361,61 @@ def batch(input, output, watermark, position, opacity, size, rotation,
         }
         kwargs['font_color'] = color_map.get(font_color.lower(), (255, 255, 255, int(255 * opacity)))
     
+    if preview:
+        render_previews(processor, image_files, output, watermark, preview_size, kwargs)
+        return
+    
+    # 预览本身就以较低分辨率渲染，输出尺寸只用于正式处理
+    if max_size:
+        kwargs['max_size'] = max_size
+    if scale:
+        kwargs['scale'] = scale
+    
     try:
         # 开始批量处理
         click.echo(f"\n{Fore.CYAN}🚀 开始处理图片...{Style.RESET_ALL}")
         
-        success_count, failed_count = processor.batch_process(
-            input_path=input,
-            output_dir=output,
-            watermark=watermark,
-            recursive=recursive,
-            suffix=suffix,
-            **kwargs
-        )
+        # 计时输出
+        sinks = []
+        if timing:
+            sinks.append(TimingStats())
+        if trace:
+            sinks.append(JsonlTimingSink(trace))
+        if metrics:
+            sinks.append(PrometheusTimingSink(metrics))
+        
+        if async_io:
+            if renditions:
+                click.echo(f"{Fore.YELLOW}⚠️  异步模式不支持多版本输出，--rendition 将被忽略{Style.RESET_ALL}")
+            if pipeline or incremental or resume:
+                click.echo(f"{Fore.YELLOW}⚠️  异步模式不支持流水线、增量和续传，这些参数将被忽略{Style.RESET_ALL}")
+            success_count, failed_count = run_async_batch(
+                processor, input, output, watermark, recursive, suffix, concurrency, workers,
+                sinks or None, include, exclude, sort_files, kwargs
+            )
+        else:
+            success_count, failed_count = processor.batch_process(
+                input_path=input,
+                output_dir=output,
+                watermark=watermark,
+                recursive=recursive,
+                suffix=suffix,
+                workers=workers,
+                pipeline=pipeline,
+                pipeline_threads=pipeline_threads,
+                incremental=incremental,
+                hash_content=hash_content,
+                resume=resume,
+                timing=sinks or None,
+                include=include,
+                exclude=exclude,
+                sort=sort_files,
+                renditions=renditions,
+                **kwargs
+            )
+        for sink in sinks:
+            if isinstance(sink, JsonlTimingSink):
+                sink.close()
         
         # 显示结果
         total = success_count + failed_count
@@ -198,16 +427,59 @@ def batch(input, output, watermark, position, opacity, size, rotation,
             click.echo(f"\n{Fore.YELLOW}⚠️  处理完成（部分失败）")
             click.echo(f"   成功: {success_count} 张")
             click.echo(f"   失败: {failed_count} 张")
-            click.echo(f"   输出目录: {output}{Style.RESET_ALL}")
-        
-        if preview:
-            click.echo(f"\n{Fore.BLUE}💡 预览完成！如果效果满意，可以去掉 --preview 参数进行批量处理{Style.RESET_ALL}")
+            click.echo(f"   输出目录: {output}")
+            click.echo(f"   💡 可以加上 --resume 参数重新运行，只处理未完成的图片{Style.RESET_ALL}")
             
     except KeyboardInterrupt:
         click.echo(f"\n{Fore.YELLOW}⏹️  用户取消操作{Style.RESET_ALL}")
     except Exception as e:
         click.echo(f"\n{Fore.RED}❌ 处理过程中出错: {e}{Style.RESET_ALL}")
 
+def run_async_batch(processor, input, output, watermark, recursive, suffix, concurrency, workers,
+                    timing, include, exclude, sort_files, kwargs):
+    """以异步模式运行批处理，用进度条显示进度"""
+    with tqdm(total=None, desc="处理进度", unit="张") as pbar:
+        def on_progress(done, total, image_file, success):
+            if total is not None and pbar.total != total:
+                pbar.total = total
+                pbar.refresh()
+            pbar.update(1)
+        
+        return asyncio.run(processor.batch_process_async(
+            input, output, watermark,
+            recursive=recursive,
+            suffix=suffix,
+            concurrency=concurrency,
+            workers=workers,
+            progress=on_progress,
+            timing=timing,
+            include=include,
+            exclude=exclude,
+            sort=sort_files,
+            **kwargs
+        ))
+
+def render_previews(processor, image_files, output, watermark, preview_size, kwargs):
+    """以降低的分辨率渲染预览图并保存到输出目录"""
+    click.echo(f"\n{Fore.CYAN}🔍 开始渲染预览...{Style.RESET_ALL}")
+    
+    for image_file in image_files:
+        input_file = Path(image_file)
+        preview_path = os.path.join(output, f"{input_file.stem}_preview{input_file.suffix}")
+        try:
+            start = time.perf_counter()
+            preview_image = processor.render_preview(
+                image_file, watermark, (preview_size, preview_size), **kwargs
+            )
+            elapsed = (time.perf_counter() - start) * 1000
+            preview_image.save(preview_path)
+            click.echo(f"   {Fore.GREEN}✔{Style.RESET_ALL} {preview_path} "
+                       f"({preview_image.size[0]}x{preview_image.size[1]}, {elapsed:.0f} ms)")
+        except Exception as e:
+            click.echo(f"   {Fore.RED}✘ {image_file}: {e}{Style.RESET_ALL}")
+    
+    click.echo(f"\n{Fore.BLUE}💡 预览完成！如果效果满意，可以去掉 --preview 参数进行批量处理{Style.RESET_ALL}")
+
 @cli.command()
 @click.option('--input', '-i',
               type=click.Path(exists=True),
@@ -236,10 +508,38 @@ def batch(input, output, watermark, position, opacity, size, rotation,
               type=click.IntRange(-180, 180),
               default=45,
               help='水印旋转角度')
-def single(input, output, watermark, position, opacity, size, rotation):
+@click.option('--font',
+              help='文字水印字体：字体文件路径或系统字体名')
+@click.option('--strips',
+              type=click.Choice(['auto', 'on', 'off']),
+              default='auto',
+              help='超大TIFF按条带读取和写入以限制内存占用 (默认: auto，超过1亿像素时启用)')
+@click.option('--frame-workers',
+              type=click.IntRange(1, 64),
+              default=1,
+              help='动画GIF/WebP并行混合各帧的线程数 (默认: 1)')
+@click.option('--profile',
+              type=click.Choice(list(WatermarkProcessor.ENCODER_PROFILES)),
+              default=WatermarkProcessor.DEFAULT_ENCODER_PROFILE,
+              help='编码配置: fast 编码最快 / balanced 均衡 / small 文件最小 (默认: balanced)')
+@click.option('--keep-jpeg-tables',
+              is_flag=True,
+              help='JPEG输出沿用原图的量化表和色度抽样')
+@click.option('--max-size',
+              callback=validate_max_size,
+              help='输出尺寸上限：最长边或 宽x高 (例如 2048 或 1920x1080)，先缩小再添加水印')
+@click.option('--scale',
+              type=click.FloatRange(0.01, 1.0),
+              help='输出缩放比例 (例如 0.5)，先缩小再添加水印')
+@click.option('--backend',
+              type=click.Choice(list(BACKENDS)),
+              default='pillow',
+              help='编解码、混合和旋转的实现: pillow / opencv / auto 按格式选择更快的实现 (默认: pillow)')
+def single(input, output, watermark, position, opacity, size, rotation, font, strips,
+           frame_workers, profile, keep_jpeg_tables, max_size, scale, backend):
     """处理单张图片"""
     
-    processor = WatermarkProcessor()
+    processor = WatermarkProcessor(backend=backend)
     
     # 转换位置参数
     position_map = {
@@ -266,7 +566,14 @@ def single(input, output, watermark, position, opacity, size, rotation):
             position=watermark_position,
             opacity=opacity,
             size_ratio=size,
-            rotation=rotation
+            rotation=rotation,
+            font_path=font,
+            strip_mode=STRIP_MODES[strips],
+            frame_workers=frame_workers,
+            encoder_profile=profile,
+            keep_jpeg_tables=keep_jpeg_tables,
+            max_size=max_size,
+            scale=scale
         )
         
         if success:
@@ -288,7 +595,7 @@ def formats():
         ("BMP", ".bmp", "Windows位图格式"),
         ("TIFF", ".tiff, .tif", "高质量图片格式"),
         ("WebP", ".webp", "Google开发的现代格式"),
-        ("GIF", ".gif", "动图格式（处理为静态图）"),
+        ("GIF", ".gif", "动图格式（逐帧添加水印）"),
     ]
     
     for name, extensions, description in formats_list:
@@ -296,6 +603,21 @@ def formats():
     
     click.echo(f"\n{Fore.YELLOW}💡 提示: 所有格式都支持批量处理{Style.RESET_ALL}")
 
+@cli.command()
+@click.option('--filter', '-f', 'name_filter',
+              help='只显示名称包含该关键字的字体')
+def fonts(name_filter):
+    """显示可用于文字水印的系统字体"""
+    found = font_registry.discover()
+    names = sorted(name for name in found if not name_filter or name_filter.lower() in name)
+    
+    click.echo(f"\n{Fore.CYAN}🔤 系统字体 ({len(names)} 个):{Style.RESET_ALL}")
+    for name in names:
+        click.echo(f"  {Fore.GREEN}• {name:<32}{Style.RESET_ALL} {found[name]}")
+    
+    default_font = font_registry.resolve()
+    click.echo(f"\n{Fore.YELLOW}💡 默认字体: {default_font or 'Pillow内置字体'}{Style.RESET_ALL}")
+
 @cli.command()
 def examples():
     """显示使用示例"""
@@ -324,14 +646,39 @@ def examples():
         },
         {
             "title": "预览效果",
-            "cmd": "python watermark_cli.py batch -i ./photos -o ./output -w '测试' --preview",
-            "desc": "预览模式，只处理第一张图片查看效果"
+            "cmd": "python watermark_cli.py batch -i ./photos -o ./output -w '测试' --preview --preview-count 3",
+            "desc": "预览模式，以屏幕分辨率快速渲染抽样的3张图片查看效果"
         },
         {
             "title": "递归处理",
             "cmd": "python watermark_cli.py batch -i ./photos -o ./output -w '水印' --recursive",
             "desc": "递归处理子目录中的所有图片"
         },
+        {
+            "title": "多进程并行处理",
+            "cmd": "python watermark_cli.py batch -i ./photos -o ./output -w '水印' --workers 8",
+            "desc": "使用8个进程并行处理，适合大批量图片"
+        },
+        {
+            "title": "网络存储流水线处理",
+            "cmd": "python watermark_cli.py batch -i /mnt/share/photos -o ./output -w '水印' --pipeline --pipeline-threads 4,2,2",
+            "desc": "读取、合成、写入分阶段并发，减少网络读取延迟造成的空闲"
+        },
+        {
+            "title": "增量处理",
+            "cmd": "python watermark_cli.py batch -i ./archive -o ./output -w '水印' --recursive --incremental",
+            "desc": "只处理新增或改动过的图片，适合定期重复运行"
+        },
+        {
+            "title": "筛选文件并立即开始",
+            "cmd": "python watermark_cli.py batch -i ./archive -o ./output -w '水印' --recursive --include '*.jpg' --exclude thumbs -y",
+            "desc": "边扫描边处理，适合文件数量巨大的目录"
+        },
+        {
+            "title": "快速编码",
+            "cmd": "python watermark_cli.py batch -i ./photos -o ./output -w '水印' --profile fast --keep-jpeg-tables",
+            "desc": "跳过JPEG霍夫曼优化，并沿用原图的量化表保持画质"
+        },
         {
             "title": "处理单张图片",
             "cmd": "python watermark_cli.py single -i photo.jpg -o watermarked.jpg -w 'Sample'",
@@ -46,6 +46,9 @@ class WatermarkGUI:
         self.margin = tk.IntVar(value=20)
         self.recursive = tk.BooleanVar(value=False)
         self.preview_mode = tk.BooleanVar(value=True)
+        self.preview_count = tk.IntVar(value=1)
+        self.encoder_profile = tk.StringVar(value=WatermarkProcessor.DEFAULT_ENCODER_PROFILE)
+        self.keep_jpeg_tables = tk.BooleanVar(value=False)
         self.watermark_type = tk.StringVar(value="text")  # text 或 image
         
         self.setup_ui()
@@ -171,6 +174,19 @@ class WatermarkGUI:
         
         ttk.Checkbutton(options_frame, text="递归处理子目录", variable=self.recursive).pack(side=tk.LEFT, padx=(0, 20))
         ttk.Checkbutton(options_frame, text="预览模式", variable=self.preview_mode).pack(side=tk.LEFT)
+        ttk.Label(options_frame, text="预览张数:").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Spinbox(options_frame, from_=1, to=20, textvariable=self.preview_count, width=5).pack(side=tk.LEFT, padx=(5, 0))
+        
+        # 编码设置
+        encoder_frame = ttk.Frame(main_frame)
+        encoder_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 10))
+        row += 1
+        
+        ttk.Label(encoder_frame, text="编码配置:").pack(side=tk.LEFT)
+        ttk.Combobox(encoder_frame, textvariable=self.encoder_profile,
+                     values=list(WatermarkProcessor.ENCODER_PROFILES),
+                     state="readonly", width=10).pack(side=tk.LEFT, padx=(5, 20))
+        ttk.Checkbutton(encoder_frame, text="沿用JPEG量化表", variable=self.keep_jpeg_tables).pack(side=tk.LEFT)
         
         # 操作按钮
         button_frame = ttk.Frame(main_frame)
@@ -386,13 +402,18 @@ class WatermarkGUI:
             # 获取图片文件列表
             image_files = self.processor.get_image_files(self.input_path.get(), self.recursive.get())
             
-            if self.preview_mode.get():
-                image_files = image_files[:1]
-            
             if not image_files:
                 self.root.after(0, lambda: self.log_message("没有找到支持的图片文件"))
                 return
             
+            if self.preview_mode.get():
+                self.render_previews(image_files, watermark, kwargs)
+                return
+            
+            # 编码设置只影响写入文件
+            kwargs['encoder_profile'] = self.encoder_profile.get()
+            kwargs['keep_jpeg_tables'] = self.keep_jpeg_tables.get()
+            
             total_files = len(image_files)
             self.root.after(0, lambda: self.progress.config(maximum=total_files))
             self.root.after(0, lambda: self.status_label.config(text=f"开始处理 {total_files} 张图片..."))
@@ -442,6 +463,47 @@ class WatermarkGUI:
             self.root.after(0, lambda: self.start_button.config(state=tk.NORMAL))
             self.root.after(0, lambda: self.stop_button.config(state=tk.DISABLED))
     
+    def render_previews(self, image_files, watermark, kwargs):
+        """以屏幕分辨率渲染抽样图片的预览（在处理线程中运行）"""
+        sampled = self.processor.sample_files(image_files, max(1, self.preview_count.get()))
+        total_files = len(sampled)
+        self.root.after(0, lambda: self.progress.config(maximum=total_files, value=0))
+        
+        previews = []
+        for i, image_file in enumerate(sampled):
+            if not self.processing:
+                break
+            try:
+                start = time.perf_counter()
+                preview = self.processor.render_preview(image_file, watermark, (800, 600), **kwargs)
+                elapsed = (time.perf_counter() - start) * 1000
+                previews.append((Path(image_file).name, preview))
+                self.log_queue.put(f"预览 {Path(image_file).name}: {preview.size[0]}x{preview.size[1]}, {elapsed:.0f} ms")
+            except Exception as e:
+                self.log_queue.put(f"预览 {image_file} 失败: {e}")
+            self.root.after(0, lambda value=i + 1: self.progress.config(value=value))
+        
+        self.root.after(0, lambda: self.status_label.config(text=f"预览完成: {len(previews)} 张"))
+        if previews:
+            self.root.after(0, lambda: self.show_preview_window(previews))
+    
+    def show_preview_window(self, previews):
+        """在新窗口中显示预览图"""
+        window = tk.Toplevel(self.root)
+        window.title("水印预览")
+        
+        notebook = ttk.Notebook(window)
+        notebook.pack(fill=tk.BOTH, expand=True)
+        
+        # 保留PhotoImage引用，避免被垃圾回收
+        window.photos = []
+        for name, preview in previews:
+            photo = ImageTk.PhotoImage(preview)
+            window.photos.append(photo)
+            frame = ttk.Frame(notebook)
+            ttk.Label(frame, image=photo).pack()
+            notebook.add(frame, text=name)
+    
     def show_formats(self):
         """显示支持的格式"""
         formats_text = """支持的图片格式：
@@ -451,7 +513,7 @@ class WatermarkGUI:
 • BMP (.bmp) - Windows位图格式
 • TIFF (.tiff, .tif) - 高质量图片格式
 • WebP (.webp) - Google开发的现代格式
-• GIF (.gif) - 动图格式（处理为静态图）
+• GIF (.gif) - 动图格式（逐帧添加水印）
 
 所有格式都支持批量处理！"""
         
@@ -481,7 +543,9 @@ class WatermarkGUI:
 
 5. 处理选项：
    • 递归处理：包含子目录中的图片
-   • 预览模式：只处理第一张图片预览效果
+   • 预览模式：快速渲染抽样图片的预览，不写入输出目录
+   • 编码配置：fast 编码最快，balanced 均衡，small 文件最小
+   • 沿用JPEG量化表：输出JPEG时保持原图的压缩质量
 
 使用技巧：
 • 建议先用预览模式查看效果
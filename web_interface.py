@@ -12,9 +12,11 @@ import threading
 import cv2
 import numpy as np
 from android_controller import AndroidController
+from watermark_api import watermark_api
 
 app = Flask(__name__)
 CORS(app)
+app.register_blueprint(watermark_api)
 
 # 全局控制器实例
 controller = AndroidController()
@@ -1019,6 +1021,7 @@ def main():
     # 启动Flask应用
     print("🌐 Web界面已启动，请在浏览器中打开: http://localhost:5000")
     print("💡 请确保您的安卓手机已启用USB调试模式")
+    print("🖼️  水印接口: http://localhost:5000/api/watermark")
     app.run(host='0.0.0.0', port=5000, debug=True)
 
 if __name__ == "__main__":